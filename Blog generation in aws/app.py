@@ -1,177 +1,494 @@
+import asyncio
+import base64
 import boto3
 import botocore.config
-import json
-
-from datetime import datetime
+import functools
+import hashlib
+import logging
+import orjson
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 from typing import Optional, List
 
-# CrewAI imports for multi-step orchestration using Bedrock via LiteLLM
+logger = logging.getLogger(__name__)
 try:
-    from crewai import Agent, Task, Crew, Process, LLM
-except Exception:
-    # Defer import errors to runtime use to keep cold-start imports lightweight
-    Agent = Task = Crew = Process = LLM = None
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+except ValueError:
+    # An unknown level name must not break cold start
+    logger.setLevel(logging.INFO)
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", os.environ["LOG_LEVEL"])
 
 
-def blog_generate_using_bedrock(blogtopic: str) -> str:
-    prompt=f"""<s>[INST]Human: Write a 200 words blog on the topic {blogtopic}
-    Assistant:[/INST]
+@functools.cache
+def _get_crewai():
+    """Import CrewAI (multi-step orchestration using Bedrock via LiteLLM) on first use.
+
+    CrewAI pulls in LiteLLM and pydantic, which is costly at cold start and
+    wasted when the direct Bedrock path is taken. Returns None if unavailable.
     """
+    try:
+        import crewai
+    except Exception:
+        return None
+    return crewai
+
+
+# Under SnapStart the import is paid once during the snapshot, not per restore
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'snap-start':
+    _get_crewai()
+
+# Llama 3.1 70B supports latency-optimized inference through the us-east-2 cross-region profile
+BEDROCK_REGION = "us-east-2"
+BEDROCK_MODEL_ID = "us.meta.llama3-1-70b-instruct-v1:0"
+
+# Static agent prompts. They are sent as the system prompt of every agent call,
+# so they are kept byte-identical across invocations to stay prefix-cacheable.
+RESEARCHER_BACKSTORY = (
+    "You are a meticulous B2B/B2C market researcher who summarizes credible insights succinctly."
+)
+
+AGENT_PROFILES = {
+    "insights_researcher": {
+        "role": "Market Research Analyst",
+        "goal": "Research the topic and identify up-to-date facts, trends, statistics, and pain points.",
+        "backstory": RESEARCHER_BACKSTORY,
+    },
+    "keywords_researcher": {
+        "role": "SEO Research Analyst",
+        "goal": "Identify the SEO keywords with the best search intent match for the topic.",
+        "backstory": RESEARCHER_BACKSTORY,
+    },
+    "angles_researcher": {
+        "role": "Editorial Research Analyst",
+        "goal": "Propose distinctive, relevant angles for an article on the topic.",
+        "backstory": RESEARCHER_BACKSTORY,
+    },
+    "strategist": {
+        "role": "Content Strategist",
+        "goal": "Design a high-converting outline aligned with the audience, brand, and SEO goals.",
+        "backstory": "You structure content to maximize clarity, search intent match, and engagement.",
+    },
+    "writer": {
+        "role": "Senior Copywriter",
+        "goal": "Write persuasive, clear copy that is accurate and on-brand.",
+        "backstory": "You write concise, engaging articles with smooth flow and strong transitions.",
+    },
+    "editor": {
+        "role": "Managing Editor",
+        "goal": (
+            "Edit for accuracy, coherence, brand tone, grammar, and SEO. Ensure factual consistency and polish."
+        ),
+        "backstory": "You are uncompromising on quality and clarity; you deliver publication-ready content.",
+    },
+}
+
+# Task description templates, ordered from most to least reusable: static
+# instructions, then the brand profile (shared by all requests for a brand),
+# then the keyword list, then the topic. Each prefix is therefore reusable by
+# every request that agrees on it, not just by exact repeats. Placeholders are
+# filled in by CrewAI from the kickoff `inputs`.
+TASK_TEMPLATES = {
+    "insights": {
+        "description": (
+            "Conduct research for the blog below. Deliver 6-10 bullet points with key insights,"
+            " stats (with approximate figures), and pain points.\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+            "Blog topic: '{blogtopic}'.\n"
+        ),
+        "expected_output": "Bullet list of insights, stats, and audience pain points.",
+    },
+    "keywords": {
+        "description": (
+            "Conduct research for the blog below. Deliver 8-12 SEO keyword ideas (short and long-tail).\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+            "Blog topic: '{blogtopic}'.\n"
+        ),
+        "expected_output": "Keyword list mixing short and long-tail SEO terms.",
+    },
+    "angles": {
+        "description": (
+            "Conduct research for the blog below. Deliver 3-5 proposed angles for the article.\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+            "Blog topic: '{blogtopic}'.\n"
+        ),
+        "expected_output": "List of 3-5 article angles suitable for planning the article.",
+    },
+    "outline": {
+        "description": (
+            "Synthesize the insights, keywords, and angles from research into a detailed outline."
+            " Include: title options, H2/H3 sections,"
+            " bullet notes per section, and an SEO snippet plan (title tag + meta description).\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+        ),
+        "expected_output": (
+            "A structured outline with 1-2 title options, 5-8 H2s (with optional H3s), and bullet notes."
+        ),
+    },
+    "write": {
+        "description": (
+            "Write an article based on the outline in the desired tone for the audience, on behalf of the brand."
+            " Incorporate the most important keywords naturally and avoid keyword stuffing.\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+            "Target length: {target_word_count} words.\n"
+        ),
+        "expected_output": (
+            "A cohesive article with intro, sections per outline, and a conclusion. No outline or notes, only prose."
+        ),
+    },
+    "edit": {
+        "description": (
+            "Revise the drafted article for clarity, correctness, brand voice, and SEO."
+            " Ensure factual consistency with the research. Add a short meta description (<= 160 chars) and a CTA."
+            " Return only the final publication-ready article text (followed by the meta description and CTA).\n"
+            "{brand_profile}"
+            "{seo_keywords}"
+        ),
+        "expected_output": (
+            "Final polished article text suitable for publishing, then a 'Meta Description:' and 'CTA:' section."
+        ),
+    },
+}
+
+BRAND_PROFILE_TMPL = "Audience: {audience}. Brand: {brand}. Desired tone: {tone}.\n"
+SEO_KEYWORDS_TMPL = "SEO keywords to prioritize: {keywords}.\n"
+BLOG_PROMPT_TMPL = "Write a 200 words blog on the topic {blogtopic}"
+
+# Bedrock prompt caching is only available on some model families
+PROMPT_CACHE_MODEL_PREFIXES = ("anthropic.", "amazon.nova-")
+
+# Clients are created once per container so warm invocations reuse their
+# sessions and kept-alive connections instead of re-resolving endpoints and TLS
+_BEDROCK = boto3.client(
+    "bedrock-runtime",
+    region_name=BEDROCK_REGION,
+    config=botocore.config.Config(
+        read_timeout=300,
+        connect_timeout=3,
+        # Adaptive mode adds a client-side rate limiter on top of jittered backoff
+        retries={'max_attempts': 8, 'mode': 'adaptive'},
+        tcp_keepalive=True,
+        max_pool_connections=20,
+    ),
+)
+_S3 = boto3.client('s3')
+_DYNAMODB = boto3.client('dynamodb')
+_SQS = boto3.client('sqs')
+
+# When set, lambda_handler queues jobs here and returns 202 instead of running
+# the pipeline inline
+BLOG_JOB_QUEUE_URL = os.environ.get("BLOG_JOB_QUEUE_URL")
+
+BLOG_S3_BUCKET = 'aws_bedrock_course1'
+
+# Generated blogs are cached by normalized request parameters; expired items
+# are removed by the table's TTL attribute
+BLOG_CACHE_TABLE = os.environ.get("BLOG_CACHE_TABLE", "blog-cache")
+BLOG_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Max research sub-crews in flight at once, overridable with
+# BEDROCK_MAX_CONCURRENCY. Size it to the account's Bedrock
+# requests/tokens-per-minute quota for the model.
+DEFAULT_RESEARCH_CONCURRENCY = 3
+
+# Budget for each task output passed on as context to later tasks. Tokens are
+# estimated from characters since Llama's tokenizer is not available locally.
+MIN_CONTEXT_TOKENS = 256
+MAX_CONTEXT_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+
+
+def _invoke_bedrock(messages: list, inference_config: dict, latency: str = "optimized") -> tuple:
+    """Stream a Converse completion, returning its text and the metadata event."""
+    try:
+        response = _BEDROCK.converse_stream(
+            modelId=BEDROCK_MODEL_ID,
+            messages=messages,
+            inferenceConfig=inference_config,
+            performanceConfig={"latency": latency},
+        )
 
-    body={
-        "prompt":prompt,
-        "max_gen_len":512,
-        "temperature":0.5,
-        "top_p":0.9
+        # Consume generation fragments as they are produced instead of waiting
+        # for the full completion to be buffered server-side
+        fragments = []
+        response_data = {}
+        for event in response['stream']:
+            if 'contentBlockDelta' in event:
+                fragments.append(event['contentBlockDelta']['delta'].get('text', ''))
+            elif 'metadata' in event:
+                response_data = event['metadata']
+        return "".join(fragments), response_data
+    except ClientError as e:
+        # Optimized capacity is limited; retry throttled requests on standard
+        # inference, whether throttled when opening the stream or mid-stream
+        if latency == "optimized" and _is_throttling_error(e):
+            return _invoke_bedrock(messages, inference_config, latency="standard")
+        raise
+
+
+def blog_generate_using_bedrock(blogtopic: str) -> str:
+    prompt = BLOG_PROMPT_TMPL.format_map({"blogtopic": blogtopic})
+
+    # The Converse API applies the model's chat template and returns parsed
+    # events, so no prompt formatting or JSON body round-trip is needed
+    messages = [{"role": "user", "content": [{"text": prompt}]}]
+    inference_config = {
+        "maxTokens": 512,
+        "temperature": 0.5,
+        "topP": 0.9,
     }
 
     try:
-        bedrock = boto3.client(
-            "bedrock-runtime",
-            region_name="us-east-1",
-            config=botocore.config.Config(read_timeout=300, retries={'max_attempts': 3}),
-        )
-        response = bedrock.invoke_model(body=json.dumps(body), modelId="meta.llama2-13b-chat-v1")
+        blog_details, response_data = _invoke_bedrock(messages, inference_config)
 
-        response_content = response.get('body').read()
-        response_data = json.loads(response_content)
-        print(response_data)
-        blog_details = response_data['generation']
+        # The metadata event carries token usage and latency metrics
+        logger.debug("bedrock stream metadata keys=%s", list(response_data.keys()))
         return blog_details
-    except Exception as e:
-        print(f"Error generating the blog:{e}")
+    except Exception:
+        logger.exception("Error generating the blog")
         return ""
 
 
-def blog_generate_using_crewai_content_marketing(
-    blogtopic: str,
-    brand_name: Optional[str] = None,
-    target_audience: Optional[str] = None,
-    tone: Optional[str] = None,
-    seo_keywords: Optional[List[str]] = None,
-    target_word_count: int = 700,
-) -> str:
-    """Multi-step orchestration using CrewAI: research → outline → write → edit.
+def _supports_prompt_cache(model_id: str) -> bool:
+    # Strip the cross-region inference profile prefix, e.g. "us."
+    geo, _, base_model_id = model_id.partition(".")
+    if geo not in ("us", "eu", "apac"):
+        base_model_id = model_id
+    return base_model_id.startswith(PROMPT_CACHE_MODEL_PREFIXES)
+
+
+def _is_throttling_error(e: BaseException) -> bool:
+    # LiteLLM surfaces Bedrock's ThrottlingException as a RateLimitError, and
+    # CrewAI may re-raise that wrapped in a plain Exception, so the whole
+    # __cause__/__context__ chain is checked. In Converse streams the error
+    # code arrives as "throttlingException".
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, ClientError):
+            if e.response["Error"]["Code"].lower() == "throttlingexception":
+                return True
+        elif type(e).__name__ in ("RateLimitError", "ThrottlingException"):
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+# CrewAI calls Bedrock through LiteLLM rather than botocore, so throttled LLM
+# calls are retried here with jittered exponential backoff
+_retry_on_throttling = retry(
+    retry=retry_if_exception(_is_throttling_error),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+
+
+@functools.cache
+def _get_bedrock_llm_class():
+    crewai = _get_crewai()
+
+    class BedrockLLM(crewai.LLM):
+        """CrewAI LLM whose individual completions are retried when throttled.
+
+        Retrying per call rather than per crew keeps finished tasks from being
+        regenerated when a later agent is throttled. When `standard_llm` is set,
+        a throttled call is repeated on it before backing off.
+        """
+
+        standard_llm = None
+
+        @_retry_on_throttling
+        def call(self, *args, **kwargs):
+            try:
+                return super().call(*args, **kwargs)
+            except Exception as e:
+                if self.standard_llm is None or not _is_throttling_error(e):
+                    raise
+            # Optimized capacity is limited; retry throttled calls on standard inference
+            logger.warning("Optimized-latency call throttled; retrying on standard latency")
+            return self.standard_llm.call(*args, **kwargs)
+
+    return BedrockLLM
+
+
+@functools.lru_cache(maxsize=128)
+def _brand_profile_block(brand_name, target_audience, tone) -> str:
+    # Immutable per brand, so it is rendered once and reused verbatim
+    audience_str = target_audience or "a general business audience"
+    tone_str = tone or "helpful, expert, and approachable"
+    brand_str = brand_name or "our brand"
+    return BRAND_PROFILE_TMPL.format_map(
+        {"audience": audience_str, "brand": brand_str, "tone": tone_str}
+    )
 
-    Falls back to direct Bedrock call if CrewAI is unavailable.
-    """
-    # Lazy import in case CrewAI is not installed in the runtime
-    if any(x is None for x in [Agent, Task, Crew, Process, LLM]):
-        print("CrewAI not available; falling back to direct Bedrock call.")
-        return blog_generate_using_bedrock(blogtopic)
 
-    bedrock_llm = LLM(
+@functools.lru_cache(maxsize=128)
+def _seo_keywords_block(seo_keywords: tuple) -> str:
+    keywords_str = ", ".join(seo_keywords) if seo_keywords else "none provided"
+    return SEO_KEYWORDS_TMPL.format_map({"keywords": keywords_str})
+
+
+def _truncate_task_output(task_output, max_context_tokens: int):
+    # Runs as the task callback, before later tasks read this output as context
+    max_chars = max_context_tokens * CHARS_PER_TOKEN
+    raw = task_output.raw or ""
+    if len(raw) <= max_chars:
+        return
+    # Cut on a word boundary so the last kept word isn't split
+    cut = raw.rfind(" ", 0, max_chars)
+    task_output.raw = raw[:cut if cut > 0 else max_chars].rstrip() + " [...]"
+
+
+@functools.cache
+def _research_concurrency() -> int:
+    # Read on first use rather than at import, so a bad value can't break cold start
+    value = os.environ.get("BEDROCK_MAX_CONCURRENCY")
+    if value is None:
+        return DEFAULT_RESEARCH_CONCURRENCY
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logger.warning(
+            "Invalid BEDROCK_MAX_CONCURRENCY %r, using %d", value, DEFAULT_RESEARCH_CONCURRENCY
+        )
+        return DEFAULT_RESEARCH_CONCURRENCY
+
+
+async def _kickoff_crews_concurrently(crews: list, inputs: dict) -> list:
+    semaphore = asyncio.Semaphore(_research_concurrency())
+
+    async def _kickoff(crew):
+        async with semaphore:
+            return await crew.kickoff_async(inputs=inputs)
+
+    return await asyncio.gather(*(_kickoff(crew) for crew in crews))
+
+
+@functools.cache
+def _build_agents(model_id: str) -> dict:
+    # Agents only depend on the model, so warm invocations reuse them instead
+    # of re-running pydantic validation for every request
+    crewai = _get_crewai()
+
+    llm_kwargs = {}
+    if _supports_prompt_cache(model_id):
+        # LiteLLM turns this into a Converse `cachePoint` after the static system prompt
+        llm_kwargs["cache_control_injection_points"] = [{"location": "message", "role": "system"}]
+
+    llm_kwargs.update(
         # Uses LiteLLM under the hood to route to AWS Bedrock
-        model="bedrock/meta.llama2-13b-chat-v1",
+        model=f"bedrock/converse/{model_id}",
         temperature=0.5,
         max_tokens=2048,
-        aws_region_name="us-east-1",
+        aws_region_name=BEDROCK_REGION,
         timeout=300,
+        # Agent outputs are only used once complete, and CrewAI's streaming
+        # handler can hide a mid-stream throttle behind partial text, so
+        # completions are not streamed on this path
+        stream=False,
     )
 
-    audience_str = target_audience or "a general business audience"
-    tone_str = tone or "helpful, expert, and approachable"
-    brand_str = brand_name or "our brand"
-    keywords_str = ", ".join(seo_keywords) if seo_keywords else ""
+    # performanceConfig is forwarded by LiteLLM to the Converse API
+    bedrock_llm = _get_bedrock_llm_class()(**llm_kwargs, performanceConfig={"latency": "optimized"})
+    bedrock_llm.standard_llm = crewai.LLM(**llm_kwargs, performanceConfig={"latency": "standard"})
 
-    researcher = Agent(
-        role="Market Research Analyst",
-        goal=(
-            "Research the topic, identify up-to-date facts, trends, statistics, pain points, and SEO keywords."
-        ),
-        backstory=(
-            "You are a meticulous B2B/B2C market researcher who summarizes credible insights succinctly."
-        ),
-        allow_delegation=False,
-        llm=bedrock_llm,
-    )
+    return {
+        name: crewai.Agent(**profile, allow_delegation=False, llm=bedrock_llm)
+        for name, profile in AGENT_PROFILES.items()
+    }
 
-    strategist = Agent(
-        role="Content Strategist",
-        goal="Design a high-converting outline aligned with the audience, brand, and SEO goals.",
-        backstory="You structure content to maximize clarity, search intent match, and engagement.",
-        allow_delegation=False,
-        llm=bedrock_llm,
-    )
 
-    writer = Agent(
-        role="Senior Copywriter",
-        goal="Write persuasive, clear copy that is accurate and on-brand.",
-        backstory="You write concise, engaging articles with smooth flow and strong transitions.",
-        allow_delegation=False,
-        llm=bedrock_llm,
-    )
+@functools.cache
+def _build_pipeline(model_id: str) -> tuple:
+    """Build the research sub-crews, the main crew and the final edit task once.
 
-    editor = Agent(
-        role="Managing Editor",
-        goal=(
-            "Edit for accuracy, coherence, brand tone, grammar, and SEO. Ensure factual consistency and polish."
-        ),
-        backstory="You are uncompromising on quality and clarity; you deliver publication-ready content.",
-        allow_delegation=False,
-        llm=bedrock_llm,
+    Tasks are created from TASK_TEMPLATES, so the only per-request string work
+    is CrewAI filling in the template placeholders at kickoff.
+    """
+    crewai = _get_crewai()
+    agents = _build_agents(model_id)
+
+    # Research is split into independent sub-tasks that fan out in parallel and
+    # fan back in to the strategist, so latency is ~max(task) instead of sum(task).
+    insights_task = crewai.Task(**TASK_TEMPLATES["insights"], agent=agents["insights_researcher"])
+    keywords_task = crewai.Task(**TASK_TEMPLATES["keywords"], agent=agents["keywords_researcher"])
+    angles_task = crewai.Task(**TASK_TEMPLATES["angles"], agent=agents["angles_researcher"])
+    research_tasks = [insights_task, keywords_task, angles_task]
+
+    outline_task = crewai.Task(
+        **TASK_TEMPLATES["outline"],
+        agent=agents["strategist"],
+        context=research_tasks,
     )
-
-    research_task = Task(
-        description=(
-            f"Conduct research for a blog about '{blogtopic}'.\n"
-            f"Audience: {audience_str}. Brand: {brand_str}. Desired tone: {tone_str}.\n"
-            f"If SEO keywords provided, prioritize them: {keywords_str if keywords_str else 'none provided'}.\n"
-            "Deliver: \n"
-            "- 6-10 bullet points with key insights, stats (with approximate figures), and pain points\n"
-            "- 8-12 SEO keyword ideas (short and long-tail)\n"
-            "- 3-5 proposed angles for the article\n"
-        ),
-        expected_output=(
-            "Bullet list of insights, keyword list, and angles suitable for planning the article."
-        ),
-        agent=researcher,
+    write_task = crewai.Task(
+        **TASK_TEMPLATES["write"],
+        agent=agents["writer"],
+        context=[*research_tasks, outline_task],
     )
-
-    outline_task = Task(
-        description=(
-            "Create a detailed outline using the research. Include: title options, H2/H3 sections,"
-            " bullet notes per section, and an SEO snippet plan (title tag + meta description)."
-        ),
-        expected_output=(
-            "A structured outline with 1-2 title options, 5-8 H2s (with optional H3s), and bullet notes."
-        ),
-        agent=strategist,
-        context=[research_task],
+    edit_task = crewai.Task(
+        **TASK_TEMPLATES["edit"],
+        agent=agents["editor"],
+        context=[*research_tasks, outline_task, write_task],
     )
 
-    write_task = Task(
-        description=(
-            f"Write a {target_word_count}-word article based on the outline. Maintain {tone_str} tone for {audience_str}. "
-            f"We are {brand_str}. Incorporate the most important keywords naturally and avoid keyword stuffing."
-        ),
-        expected_output=(
-            "A cohesive article with intro, sections per outline, and a conclusion. No outline or notes, only prose."
-        ),
-        agent=writer,
-        context=[research_task, outline_task],
-    )
+    research_crews = [
+        crewai.Crew(agents=[task.agent], tasks=[task], process=crewai.Process.sequential)
+        for task in research_tasks
+    ]
 
-    edit_task = Task(
-        description=(
-            "Revise the drafted article for clarity, correctness, brand voice, and SEO."
-            " Ensure factual consistency with the research. Add a short meta description (<= 160 chars) and a CTA."
-            " Return only the final publication-ready article text (followed by the meta description and CTA)."
-        ),
-        expected_output=(
-            "Final polished article text suitable for publishing, then a 'Meta Description:' and 'CTA:' section."
-        ),
-        agent=editor,
-        context=[research_task, outline_task, write_task],
+    # Downstream tasks read the research outputs through their `context`
+    crew = crewai.Crew(
+        agents=[agents["strategist"], agents["writer"], agents["editor"]],
+        tasks=[outline_task, write_task, edit_task],
+        process=crewai.Process.sequential,
     )
 
-    crew = Crew(
-        agents=[researcher, strategist, writer, editor],
-        tasks=[research_task, outline_task, write_task, edit_task],
-        process=Process.sequential,
-    )
+    # The draft is what the editor revises, so only research and outline are capped
+    context_tasks = [*research_tasks, outline_task]
+
+    return research_crews, crew, context_tasks, edit_task
+
+
+def blog_generate_using_crewai_content_marketing(
+    blogtopic: str,
+    brand_name: Optional[str] = None,
+    target_audience: Optional[str] = None,
+    tone: Optional[str] = None,
+    seo_keywords: Optional[List[str]] = None,
+    target_word_count: int = 700,
+    max_context_tokens: int = MAX_CONTEXT_TOKENS,
+) -> str:
+    """Multi-step orchestration using CrewAI: research (fan-out) → outline → write → edit.
+
+    Falls back to direct Bedrock call if CrewAI is unavailable.
+    """
+    # Lazy import in case CrewAI is not installed in the runtime
+    if _get_crewai() is None:
+        logger.warning("CrewAI not available; falling back to direct Bedrock call.")
+        return blog_generate_using_bedrock(blogtopic)
+
+    research_crews, crew, context_tasks, edit_task = _build_pipeline(BEDROCK_MODEL_ID)
+    inputs = {
+        "brand_profile": _brand_profile_block(brand_name, target_audience, tone),
+        "seo_keywords": _seo_keywords_block(tuple(seo_keywords or ())),
+        "blogtopic": blogtopic,
+        "target_word_count": target_word_count,
+    }
+
+    for task in context_tasks:
+        task.callback = functools.partial(_truncate_task_output, max_context_tokens=max_context_tokens)
 
-    result = crew.kickoff()
+    asyncio.run(_kickoff_crews_concurrently(research_crews, inputs))
+    result = crew.kickoff(inputs=inputs)
 
     # Try to extract the editor's final output if available
     try:
@@ -185,50 +502,212 @@ def blog_generate_using_crewai_content_marketing(
     return str(result).strip()
 
 def save_blog_details_s3(s3_key, s3_bucket, generate_blog):
-    s3 = boto3.client('s3')
+    # Errors propagate so callers never treat an unsaved blog as delivered
+    _S3.put_object(Bucket=s3_bucket, Key=s3_key, Body=generate_blog.encode('utf-8'))
+    logger.debug("Content saved to s3: %s", s3_key)
+
+
+def _blog_cache_key(
+    blogtopic, brand_name, target_audience, tone, seo_keywords, target_word_count, max_context_tokens
+) -> str:
+    # Whitespace and keyword order don't change the generated blog, so they are
+    # normalized away to let near-duplicate requests share an entry. Case is
+    # kept because the values are interpolated into the prompts verbatim.
+    def normalize(value):
+        return " ".join(str(value).split()) if value else ""
+
+    params = {
+        "blog_topic": normalize(blogtopic),
+        "brand_name": normalize(brand_name),
+        "target_audience": normalize(target_audience),
+        "tone": normalize(tone),
+        "seo_keywords": sorted({normalize(k) for k in seo_keywords or []}),
+        "target_word_count": str(target_word_count),
+        "max_context_tokens": str(max_context_tokens),
+    }
+    return hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def get_cached_blog(cache_key) -> Optional[str]:
+    """Return the S3 key of a previously generated blog for this request, if any."""
+    try:
+        item = _DYNAMODB.get_item(
+            TableName=BLOG_CACHE_TABLE,
+            Key={'cache_key': {'S': cache_key}},
+            ProjectionExpression='s3_key, expires_at',
+        ).get('Item')
+        # TTL deletion is lazy, so expired items may still be returned for a while
+        if item is None or int(item['expires_at']['N']) < time.time():
+            return None
+        return item['s3_key']['S']
+    except Exception as e:
+        logger.warning("Error when reading the blog cache: %s", e)
+        return None
+
 
+def save_cached_blog(cache_key, s3_key):
+    # Only called once the blog is confirmed in S3, so a hit never points at a missing key
     try:
-        s3.put_object(Bucket=s3_bucket, Key=s3_key, Body=generate_blog)
-        print("Content saved to s3")
+        _DYNAMODB.put_item(
+            TableName=BLOG_CACHE_TABLE,
+            Item={
+                'cache_key': {'S': cache_key},
+                's3_key': {'S': s3_key},
+                'expires_at': {'N': str(int(time.time()) + BLOG_CACHE_TTL_SECONDS)},
+            },
+        )
     except Exception as e:
-        print("Error when saving the content to s3", e)
+        logger.warning("Error when writing the blog cache: %s", e)
 
 
+def _parse_blog_request(event: dict) -> dict:
+    # Maps the request body onto blog_generate_using_crewai_content_marketing kwargs
+    return {
+        'blogtopic': event['blog_topic'],
+        'brand_name': event.get('brand_name'),
+        'target_audience': event.get('target_audience'),
+        'tone': event.get('tone'),
+        'seo_keywords': _seo_keywords(event.get('seo_keywords')),
+        'target_word_count': event.get('target_word_count', 700),
+        'max_context_tokens': _context_token_budget(event.get('max_context_tokens', MAX_CONTEXT_TOKENS)),
+    }
 
-def lambda_handler(event, context):
-    # Accept API Gateway input. Expected body JSON with at least 'blog_topic'.
-    event = json.loads(event['body'])
-    blogtopic = event['blog_topic']
 
-    brand = event.get('brand_name')
-    audience = event.get('target_audience')
-    tone = event.get('tone')
-    seo_keywords = event.get('seo_keywords')  # optional list
-    word_count = event.get('target_word_count', 700)
+def _seo_keywords(value) -> Optional[List[str]]:
+    # Optional, but when given it must be a list of strings so both the
+    # prompt block and the cache key can iterate it
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(k, str) for k in value):
+        raise ValueError("seo_keywords must be a list of strings")
+    return value
 
+
+def _context_token_budget(value) -> int:
+    # Client-supplied, so out-of-range values are clamped rather than allowed
+    # to empty the context or lift the cost cap
+    if isinstance(value, bool):
+        raise ValueError("max_context_tokens must be an integer")
+    try:
+        tokens = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("max_context_tokens must be an integer") from None
+    return min(max(tokens, MIN_CONTEXT_TOKENS), MAX_CONTEXT_TOKENS)
+
+
+def _new_job_id() -> str:
+    # The random suffix keeps ids unique when requests land in the same second
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+
+
+def _blog_s3_key(job_id: str) -> str:
+    return f"blog-output/{job_id}.txt"
+
+
+def generate_and_store_blog(blog_request: dict, job_id: str, cache_key: str) -> bool:
     # Use multi-step CrewAI pipeline; fallback internally to direct Bedrock if needed
-    generate_blog = blog_generate_using_crewai_content_marketing(
-        blogtopic=blogtopic,
-        brand_name=brand,
-        target_audience=audience,
-        tone=tone,
-        seo_keywords=seo_keywords,
-        target_word_count=word_count,
-    )
+    generate_blog = blog_generate_using_crewai_content_marketing(**blog_request)
+    if not generate_blog:
+        logger.warning("No blog was generated for job %s", job_id)
+        return False
 
-    if generate_blog:
-        current_time = datetime.now().strftime('%Y%m%d-%H%M%S')
-        s3_key = f"blog-output/{current_time}.txt"
-        s3_bucket = 'aws_bedrock_course1'
-        save_blog_details_s3(s3_key, s3_bucket, generate_blog)
-    else:
-        print("No blog was generated")
+    s3_key = _blog_s3_key(job_id)
+    save_blog_details_s3(s3_key, BLOG_S3_BUCKET, generate_blog)
+    save_cached_blog(cache_key, s3_key)
+    return True
+
+
+def lambda_handler(event, context):
+    # Accept API Gateway input. Expected body JSON with at least 'blog_topic'.
+    # orjson parses str or bytes directly, so a base64 body is decoded only once.
+    body = event['body']
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    try:
+        blog_request = _parse_blog_request(orjson.loads(body))
+    except (KeyError, TypeError, ValueError) as e:
+        # orjson.JSONDecodeError is a ValueError
+        return {
+            'statusCode': 400,
+            'body': orjson.dumps(f"Invalid request: {e}").decode()
+        }
+
+    # Repeat requests are served from the cache without invoking Bedrock
+    cache_key = _blog_cache_key(**blog_request)
+    cached_s3_key = get_cached_blog(cache_key)
+    if cached_s3_key is not None:
+        return {
+            'statusCode': 200,
+            'body': orjson.dumps({'s3_key': cached_s3_key}).decode()
+        }
+
+    job_id = _new_job_id()
+
+    # The pipeline outlasts API Gateway's 29s timeout, so when a job queue is
+    # configured the request is handed to sqs_worker_handler and accepted here
+    if BLOG_JOB_QUEUE_URL:
+        try:
+            _SQS.send_message(
+                QueueUrl=BLOG_JOB_QUEUE_URL,
+                MessageBody=orjson.dumps(
+                    {'job_id': job_id, 'cache_key': cache_key, 'request': blog_request}
+                ).decode(),
+            )
+        except Exception:
+            logger.exception("Error queueing blog job %s", job_id)
+            return {
+                'statusCode': 503,
+                'body': orjson.dumps('Blog job could not be queued').decode()
+            }
+        return {
+            'statusCode': 202,
+            'body': orjson.dumps({'job_id': job_id, 's3_key': _blog_s3_key(job_id)}).decode()
+        }
+
+    try:
+        stored = generate_and_store_blog(blog_request, job_id, cache_key)
+    except Exception:
+        logger.exception("Error generating the blog for job %s", job_id)
+        stored = False
+    if not stored:
+        return {
+            'statusCode': 500,
+            'body': orjson.dumps('Blog could not be generated').decode()
+        }
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Blog generation is completed')
+        'body': orjson.dumps({'job_id': job_id, 's3_key': _blog_s3_key(job_id)}).decode()
     }
 
+
+def sqs_worker_handler(event, context):
+    # Consumes jobs queued by lambda_handler. Failed records are reported back
+    # so SQS redelivers only those (requires ReportBatchItemFailures).
+    failures = []
+    for record in event['Records']:
+        # A malformed record fails alone instead of redelivering the whole batch.
+        # Upload errors propagate out of generate_and_store_blog, so a job is
+        # only acknowledged once its blog is in S3.
+        try:
+            job = orjson.loads(record['body'])
+            # An identical request may have finished since this job was queued;
+            # copy its blog to the key promised in the 202 instead of regenerating
+            cached_s3_key = get_cached_blog(job['cache_key'])
+            if cached_s3_key is not None:
+                _S3.copy_object(
+                    Bucket=BLOG_S3_BUCKET,
+                    Key=_blog_s3_key(job['job_id']),
+                    CopySource={'Bucket': BLOG_S3_BUCKET, 'Key': cached_s3_key},
+                )
+            elif not generate_and_store_blog(job['request'], job['job_id'], job['cache_key']):
+                failures.append({'itemIdentifier': record['messageId']})
+        except Exception:
+            logger.exception("Error processing blog job message %s", record['messageId'])
+            failures.append({'itemIdentifier': record['messageId']})
+
+    return {'batchItemFailures': failures}
+
     
 
 
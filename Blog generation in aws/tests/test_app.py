@@ -0,0 +1,161 @@
+import os
+import sys
+import types
+from unittest import mock
+
+import orjson
+
+import pytest
+from tenacity import wait_none
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RateLimitError(Exception):
+    """Stand-in for litellm.RateLimitError."""
+
+
+class FakeLLM:
+    """Minimal crewai.LLM replacement whose calls follow a scripted outcome."""
+
+    def __init__(self, outcomes=(), **kwargs):
+        self.kwargs = kwargs
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def call(self, *args, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def _streaming_throttle():
+    # CrewAI's streaming handler re-raises LiteLLM errors as a plain Exception
+    try:
+        raise RateLimitError("BedrockException - ThrottlingException: Too many requests")
+    except RateLimitError as e:
+        try:
+            raise Exception(f"Failed to get streaming response: {e}")
+        except Exception as wrapped:
+            return wrapped
+
+
+sys.modules["crewai"] = types.SimpleNamespace(LLM=FakeLLM)
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def bedrock_llm_class(monkeypatch):
+    cls = app._get_bedrock_llm_class()
+    monkeypatch.setattr(cls.call.retry, "wait", wait_none())
+    return cls
+
+
+def test_is_throttling_error_walks_wrapped_exceptions():
+    assert app._is_throttling_error(_streaming_throttle())
+    assert not app._is_throttling_error(Exception("Failed to get streaming response: bad request"))
+
+
+def test_bedrock_llm_retries_throttled_call(bedrock_llm_class):
+    llm = bedrock_llm_class(outcomes=[_streaming_throttle(), "draft"])
+
+    assert llm.call([{"role": "user", "content": "hi"}]) == "draft"
+    assert llm.calls == 2
+
+
+def test_bedrock_llm_does_not_retry_other_errors(bedrock_llm_class):
+    llm = bedrock_llm_class(outcomes=[ValueError("bad prompt"), "draft"])
+
+    with pytest.raises(ValueError):
+        llm.call([{"role": "user", "content": "hi"}])
+    assert llm.calls == 1
+
+
+def test_bedrock_llm_falls_back_to_standard_latency(bedrock_llm_class):
+    llm = bedrock_llm_class(outcomes=[_streaming_throttle()])
+    llm.standard_llm = FakeLLM(outcomes=["draft"])
+
+    assert llm.call([{"role": "user", "content": "hi"}]) == "draft"
+    assert llm.calls == 1
+    assert llm.standard_llm.calls == 1
+
+
+def _sqs_event(job):
+    return {"Records": [{"messageId": "m-1", "body": orjson.dumps(job).decode()}]}
+
+
+def test_sqs_worker_acknowledges_cached_job_without_generating(monkeypatch):
+    s3 = mock.Mock()
+    generate = mock.Mock()
+    monkeypatch.setattr(app, "_S3", s3)
+    monkeypatch.setattr(app, "get_cached_blog", lambda cache_key: "blog-output/earlier.txt")
+    monkeypatch.setattr(app, "generate_and_store_blog", generate)
+
+    result = app.sqs_worker_handler(
+        _sqs_event({"job_id": "job-1", "cache_key": "k", "request": {"blogtopic": "AI"}}), None
+    )
+
+    assert result == {"batchItemFailures": []}
+    generate.assert_not_called()
+    s3.copy_object.assert_called_once_with(
+        Bucket=app.BLOG_S3_BUCKET,
+        Key="blog-output/job-1.txt",
+        CopySource={"Bucket": app.BLOG_S3_BUCKET, "Key": "blog-output/earlier.txt"},
+    )
+
+
+def test_lambda_handler_returns_503_when_job_cannot_be_queued(monkeypatch):
+    sqs = mock.Mock()
+    sqs.send_message.side_effect = RuntimeError("queue unavailable")
+    monkeypatch.setattr(app, "_SQS", sqs)
+    monkeypatch.setattr(app, "BLOG_JOB_QUEUE_URL", "https://sqs.example/queue")
+    monkeypatch.setattr(app, "get_cached_blog", lambda cache_key: None)
+
+    response = app.lambda_handler({"body": orjson.dumps({"blog_topic": "AI"}).decode()}, None)
+
+    assert response["statusCode"] == 503
+    assert orjson.loads(response["body"]) == "Blog job could not be queued"
+
+
+@pytest.mark.parametrize("seo_keywords", [5, "cloud", ["cloud", 5]])
+def test_lambda_handler_rejects_invalid_seo_keywords(seo_keywords):
+    body = orjson.dumps({"blog_topic": "AI", "seo_keywords": seo_keywords}).decode()
+
+    response = app.lambda_handler({"body": body}, None)
+
+    assert response["statusCode"] == 400
+
+
+def test_blog_cache_key_keeps_case_but_ignores_whitespace_and_keyword_order():
+    params = dict(
+        brand_name="Acme",
+        target_audience=None,
+        tone="Formal",
+        target_word_count=700,
+        max_context_tokens=1500,
+    )
+    key = app._blog_cache_key(blogtopic="AWS Lambda", seo_keywords=["a", "b"], **params)
+
+    assert key == app._blog_cache_key(blogtopic="  AWS   Lambda ", seo_keywords=["b", "a"], **params)
+    assert key != app._blog_cache_key(blogtopic="aws lambda", seo_keywords=["a", "b"], **params)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [(None, 3), ("5", 5), ("0", 1), ("three", 3)],
+)
+def test_research_concurrency_falls_back_on_invalid_setting(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("BEDROCK_MAX_CONCURRENCY", raising=False)
+    else:
+        monkeypatch.setenv("BEDROCK_MAX_CONCURRENCY", value)
+    app._research_concurrency.cache_clear()
+
+    try:
+        assert app._research_concurrency() == expected
+    finally:
+        app._research_concurrency.cache_clear()